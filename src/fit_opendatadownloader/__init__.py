@@ -1,4 +1,5 @@
 from .fit_downloader import Layer as Layer
 from .fit_downloader import parse_config as parse_config
+from .fit_downloader import process_config as process_config
 
 __version__ = "0.0.1a1"
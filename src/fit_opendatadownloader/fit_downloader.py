@@ -1,31 +1,32 @@
+import functools
 import glob
+import hashlib
+import io
 import json
 import logging
 import os
 import re
-import shutil
 import tempfile
 import zipfile
 from pathlib import Path
 from urllib.parse import urlparse
 
-import bcdata
 import boto3
 import click
 import fit_changedetector as fcd
 import geopandas
 import jsonschema
+import numpy as np
+import pandas as pd
+import shapely
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from cligj import quiet_opt, verbose_opt
 from esridump.dumper import EsriDumper
 from geopandas import GeoDataFrame
 from pyproj import CRS
-from shapely.geometry.linestring import LineString
-from shapely.geometry.multilinestring import MultiLineString
-from shapely.geometry.multipoint import MultiPoint
-from shapely.geometry.multipolygon import MultiPolygon
-from shapely.geometry.point import Point
-from shapely.geometry.polygon import Polygon
+from shapely.geometry import shape
 
 LOG = logging.getLogger(__name__)
 
@@ -38,6 +39,50 @@ SUPPORTED_SPATIAL_TYPES = [
     "MULTIPOLYGON",
 ]
 
+BC_ALBERS = CRS.from_epsg(3005)
+
+# characters stripped from column names when cleaning
+NON_WORD_PATTERN = re.compile(r"\W+")
+
+# name of s3 object metadata key holding the hash of the data written
+CONTENT_HASH_KEY = "content-sha256"
+
+# zipped gdbs up to this size are buffered in memory before upload, larger spill to disk
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+# share a single boto3 session/client between all layers, pooling (kept alive)
+# connections and retrying throttled/failed requests with adaptive backoff
+S3_SESSION = boto3.session.Session()
+S3_CONFIG = Config(
+    max_pool_connections=32,
+    tcp_keepalive=True,
+    retries={"max_attempts": 5, "mode": "adaptive"},
+)
+# upload larger files in concurrent 16MB parts
+S3_TRANSFER_CONFIG = TransferConfig(multipart_chunksize=16 * 1024 * 1024, max_concurrency=16)
+
+
+@functools.cache
+def s3_client():
+    """Return the shared s3 client, created on first use (boto3 clients are thread safe)"""
+    return S3_SESSION.client("s3", config=S3_CONFIG)
+
+
+@functools.cache
+def load_schema():
+    """Read the source schema document (once)"""
+    with open("source_schema.json", "r") as f:
+        return json.load(f)
+
+
+@functools.cache
+def schema_validator():
+    """Return a validator for the source schema, checked and built once"""
+    schema = load_schema()
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
 
 def configure_logging(verbosity):
     log_level = max(10, 30 - 10 * verbosity)
@@ -52,14 +97,47 @@ def configure_logging(verbosity):
     logging.getLogger("botocore.configprovider").setLevel(logging.WARNING)
 
 
+@functools.lru_cache(maxsize=4096)
+def clean_column_name(column):
+    """Lowercase a column name, replacing spaces with underscores and removing special characters"""
+    return NON_WORD_PATTERN.sub("", column.lower().strip().replace(" ", "_"))
+
+
+def esri_to_gdf(source, fields):
+    """
+    Download features from an Esri REST API endpoint to a GeoDataFrame, collecting attributes
+    and geometries in separate lists as pages stream in (rather than a dict per feature)
+    """
+    properties = []
+    geometries = []
+    for feature in EsriDumper(source, fields=fields, parent_logger=LOG):
+        properties.append(feature.get("properties") or {})
+        geometry = feature.get("geometry")
+        geometries.append(shape(geometry) if geometry else None)
+    return GeoDataFrame(properties, geometry=geometries, crs=4326)
+
+
+def gdf_hash(df, sort_key):
+    """
+    Return a sha256 hex digest of a geodataframe's column names, attribute values and
+    geometry WKB, with rows sorted by sort_key so the digest does not depend on row order
+    """
+    df = df.sort_values(by=sort_key)
+    h = hashlib.sha256(",".join(df.columns).encode())
+    attributes = pd.DataFrame(df.drop(columns=df.geometry.name))
+    h.update(pd.util.hash_pandas_object(attributes, index=False).to_numpy().tobytes())
+    h.update(pd.util.hash_pandas_object(df.geometry.to_wkb(), index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
 def zip_gdb(gdb_path, zip_path):
-    """Compress the contents of a .gdb folder into a zip file."""
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(gdb_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(file_path, gdb_path)
-                zipf.write(file_path, relative_path)
+    """Compress the contents of a .gdb folder into a zip file (path or file-like object)."""
+    # fastest deflate level, higher levels cost much more cpu for little size reduction
+    root = Path(gdb_path)
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zipf:
+        for file_path in root.rglob("*"):
+            if file_path.is_file():
+                zipf.write(file_path, file_path.relative_to(root))
 
 
 def gdf_standardize_spatial_types(df):
@@ -79,27 +157,26 @@ def gdf_standardize_spatial_types(df):
     # promote geometries to multipart if any multipart features are found
     if set(types).intersection(set(("MULTIPOINT", "MULTILINESTRING", "MULTIPOLYGON"))):
         LOG.info("Promoting all features to multipart")
-        df.geometry = [
-            MultiPoint([feature]) if isinstance(feature, Point) else feature
-            for feature in df.geometry
-        ]
-        df.geometry = [
-            MultiLineString([feature]) if isinstance(feature, LineString) else feature
-            for feature in df.geometry
-        ]
-        df.geometry = [
-            MultiPolygon([feature]) if isinstance(feature, Polygon) else feature
-            for feature in df.geometry
-        ]
+        # wrap singlepart geometries of each type in one vectorized call, leaving
+        # existing multipart geometries untouched
+        geoms = df.geometry.to_numpy().copy()
+        type_ids = shapely.get_type_id(geoms)
+        for type_id, to_multi in (
+            (shapely.GeometryType.POINT, shapely.multipoints),
+            (shapely.GeometryType.LINESTRING, shapely.multilinestrings),
+            (shapely.GeometryType.POLYGON, shapely.multipolygons),
+        ):
+            mask = type_ids == type_id
+            if mask.any():
+                geoms[mask] = to_multi(geoms[mask], indices=np.arange(mask.sum()))
+        df.geometry = geopandas.GeoSeries(geoms, index=df.index, crs=df.crs)
     return df
 
 
 class Layer:
     def __init__(self, layer_keys, load_id="fdl_load_id", out_path="."):
         # initialize object with empty values for all properties present in schema
-        with open("source_schema.json", "r") as f:
-            schema = json.load(f)
-        for key in schema["items"]["properties"]:
+        for key in load_schema()["items"]["properties"]:
             setattr(self, key, None)
         # overwrite empty attributes with values from config keys
         if layer_keys is not None:
@@ -109,21 +186,30 @@ class Layer:
         # note name of field to use for hashed id
         self.load_id = load_id
 
-        # output file name
-        self.out_file = os.path.join(out_path, self.out_layer + ".gdb.zip")
+        # output file names - data is written as zipped gdb (default) or geoparquet,
+        # changes are always written as zipped gdb
+        if not self.out_format:
+            self.out_format = "gdb"
+        if self.out_format == "parquet":
+            self.out_file = os.path.join(out_path, self.out_layer + ".parquet")
+        else:
+            self.out_file = os.path.join(out_path, self.out_layer + ".gdb.zip")
+        self.changes_file = os.path.join(out_path, self.out_layer + "_changes.gdb.zip")
 
         # are we working with files on s3?
         if self.out_file.startswith("s3://"):
-            self.s3 = boto3.client("s3")
+            self.s3 = s3_client()
             self.s3_key = urlparse(self.out_file, allow_fragments=False).path.lstrip("/")
-            self.s3_changes_key = self.s3_key.replace(
-                self.out_layer + ".gdb.zip", self.out_layer + "_changes.gdb.zip"
+            self.s3_changes_key = urlparse(self.changes_file, allow_fragments=False).path.lstrip(
+                "/"
             )
             # self.s3_log_key =
         else:
             self.s3 = None
 
         self.gdf = None
+        self._out_file_exists = None
+        self._out_file_metadata = {}
         self.duplicates = []
         self.duplicate_report = {}
         self.change_report = {}
@@ -133,14 +219,23 @@ class Layer:
 
     @property
     def out_file_exists(self):
-        """Return true if output file exists, supporting both local files and s3 keys"""
+        """
+        Return true if output file exists, supporting both local files and s3 keys.
+        The result is cached after the first check, dump() updates it after writing.
+        """
+        if self._out_file_exists is None:
+            self._out_file_exists = self._check_out_file_exists()
+        return self._out_file_exists
+
+    def _check_out_file_exists(self):
         # if working with s3 path, use s3 methods
         if self.s3:
             try:
                 # Extract bucket name and object key from the path, check if key exists
                 s3_url = self.out_file[5:]  # Strip 's3://'
                 bucket_name, key = s3_url.split("/", 1)
-                self.s3.head_object(Bucket=bucket_name, Key=key)
+                response = self.s3.head_object(Bucket=bucket_name, Key=key)
+                self._out_file_metadata = response.get("Metadata", {})
                 return True
             except ClientError as e:
                 # when head_object returns 404 (Not Found), file doesn't exist
@@ -159,22 +254,32 @@ class Layer:
 
         # download data from esri rest api endpoint
         if self.protocol == "esri":
-            df = GeoDataFrame.from_features(
-                features=(EsriDumper(self.source, fields=self.fields, parent_logger=LOG)),
-                crs=4326,
-            )
+            df = esri_to_gdf(self.source, self.fields)
 
         # download from BC WFS
         elif self.protocol == "bcgw":
+            # import on use, bcdata makes a network request (for its primary key list) on import
+            import bcdata
+
             df = bcdata.get_data(self.source, query=self.query, as_gdf=True)
 
         # download data from location readable by ogr
         elif self.protocol == "http":
+            source = os.path.expandvars(self.source)
+            # read only the configured fields - skip this when a query is given, some drivers
+            # do not filter correctly on fields that are not read
+            columns = None if self.query else [f for f in self.fields if f]
             df = geopandas.read_file(
-                os.path.expandvars(self.source),
+                source,
                 layer=self.source_layer,
                 where=self.query,
+                columns=columns,
             )
+            # names are matched exactly and unmatched names are dropped - if any are missing
+            # re-read all columns so that fields differing only in case are found
+            # (fields absent from the source are reported by the check below)
+            if columns and not set(columns).issubset(df.columns):
+                df = geopandas.read_file(source, layer=self.source_layer, where=self.query)
 
         # are expected columns present?
         for column in self.fields:
@@ -205,6 +310,7 @@ class Layer:
         self,
         precision=0.01,
         drop_geom_duplicates=False,
+        strict_types=True,
     ):
         """
         Standardize a geodataframe, confirming:
@@ -218,29 +324,31 @@ class Layer:
         - if primary key is not provided:
         -    - create hash of the geometry to use as primary key (defaulting to 1cm coordinate precision)
         -    - optionally, drop duplicate records (based on geometry hash key)
+        - if strict_types, round trip data through a .gdb so column types match those of
+          the written output (skip when the data is not going to be written)
         """
+        # modify the downloaded frame in place where possible, rather than creating copies
         df = self.gdf
 
         # reproject to BC Albers if necessary
-        if df.crs != CRS.from_user_input(3005):
-            df = df.to_crs("EPSG:3005")
+        if df.crs is None or not df.crs.equals(BC_ALBERS):
+            df.to_crs(BC_ALBERS, inplace=True)
 
         # standardize column naming
         if df.geometry.name != "geometry":
-            df = df.rename_geometry("geometry")
+            df.rename_geometry("geometry", inplace=True)
 
-        cleaned_column_map = {}
-        for column in self.fields + self.hash_fields:
-            cleaned_column_map[column] = re.sub(
-                r"\W+", "", column.lower().strip().replace(" ", "_")
-            )
-        df = df.rename(columns=cleaned_column_map)
+        cleaned_column_map = {
+            column: clean_column_name(column) for column in self.fields + self.hash_fields
+        }
+        df.rename(columns=cleaned_column_map, inplace=True)
 
         # assign cleaned column names to fields list
         fields = list(cleaned_column_map.values())
         hash_fields = [cleaned_column_map[k] for k in self.hash_fields]
 
         # drop any columns not listed in config (minus geometry)
+        # (selecting rather than dropping, so columns are ordered as per config)
         df = df[fields + ["geometry"]]
 
         # check and fix spatial types (working with original geometries)
@@ -280,11 +388,11 @@ class Layer:
             pks = [self.load_id]
 
             # if duplicates are present in the hash key, log/note the duplication
-            if len(df) != len(df[self.load_id].drop_duplicates()):
+            duplicated = df[self.load_id].duplicated(keep=False)
+            if duplicated.any():
                 dup_fields = "/".join(["geometry"] + hash_fields)
-                df["_duplicated_"] = df.duplicated(keep=False, subset=[self.load_id])
                 duplicates = (
-                    df[df["_duplicated_"]][[self.load_id] + fields]
+                    df.loc[duplicated, [self.load_id] + fields]
                     .sort_values(by=[self.load_id])
                     .to_dict("records")
                 )
@@ -292,59 +400,115 @@ class Layer:
                 self.duplicates = duplicates
                 self.duplicate_report["n_duplicates"] = len(duplicates)
                 self.duplicate_report["duplicate_ids"] = ",".join(
-                    [k[self.load_id] for k in duplicates]
+                    k[self.load_id] for k in duplicates
                 )
 
             # if specified, drop duplicates
             if duplicates and drop_geom_duplicates:
                 LOG.info(f"Duplicate {dup_fields} found when hashing, dropping duplicate rows")
-                df = df.drop_duplicates(subset=[self.load_id])
+                df.drop_duplicates(subset=[self.load_id], inplace=True)
 
         # to ensure type consistency, round trip to gdb and back to geopandas
-        df.to_file(
-            os.path.join(self.tempdir, "_roundtrip_.gdb"),
-            driver="OpenFileGDB",
-            layer=self.out_layer,
-            mode="w",
-        )
-        self.gdf = geopandas.read_file(
-            os.path.join(self.tempdir, "_roundtrip_.gdb"), layer=self.out_layer
-        )
+        # (via arrow, as when reading existing output for change detection)
+        if strict_types:
+            df.to_file(
+                os.path.join(self.tempdir, "_roundtrip_.gdb"),
+                driver="OpenFileGDB",
+                layer=self.out_layer,
+                mode="w",
+                use_arrow=True,
+            )
+            df = geopandas.read_file(
+                os.path.join(self.tempdir, "_roundtrip_.gdb"),
+                layer=self.out_layer,
+                use_arrow=True,
+            )
+        self.gdf = df
 
-    def dump(self):
-        # write uncompressed .gdb in /tmp
-        self.gdf.to_file(
-            os.path.join(self.tempdir, self.out_layer + ".gdb"),
-            driver="OpenFileGDB",
-            layer=self.out_layer,
-        )
-        # compress the .gdb, still in /tmp
-        zip_gdb(
-            os.path.join(self.tempdir, self.out_layer + ".gdb"),
-            os.path.join(self.tempdir, self.out_layer + ".gdb.zip"),
-        )
+    def _write_gdb_zip(self, gdb_path, out_file, s3_key=None, metadata=None):
+        """
+        Compress a .gdb to out_file, or if a s3_key is provided, zip to a spooled buffer
+        and upload from there (no zip is written to the tempdir)
+        """
+        if s3_key:
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as f:
+                zip_gdb(gdb_path, f)
+                f.seek(0)
+                self.s3.upload_fileobj(
+                    f,
+                    os.environ.get("BUCKET"),
+                    s3_key,
+                    ExtraArgs={"Metadata": metadata} if metadata else None,
+                    Config=S3_TRANSFER_CONFIG,
+                )
+        else:
+            zip_gdb(gdb_path, out_file)
+
+    def _write_parquet(self, metadata=None):
+        """Write data to out_file as zstd compressed geoparquet, uploading if on s3"""
+        if self.s3:
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as f:
+                self.gdf.to_parquet(f, compression="zstd")
+                f.seek(0)
+                self.s3.upload_fileobj(
+                    f,
+                    os.environ.get("BUCKET"),
+                    self.s3_key,
+                    ExtraArgs={"Metadata": metadata} if metadata else None,
+                    Config=S3_TRANSFER_CONFIG,
+                )
+        else:
+            self.gdf.to_parquet(self.out_file, compression="zstd")
+
+    def _read_previous(self):
+        """Read the existing output file"""
+        if self.out_format == "parquet":
+            # read object via boto3 so the configured s3 endpoint/credentials are used
+            if self.s3:
+                response = self.s3.get_object(Bucket=os.environ.get("BUCKET"), Key=self.s3_key)
+                return geopandas.read_parquet(io.BytesIO(response["Body"].read()))
+            return geopandas.read_parquet(self.out_file)
+        return geopandas.read_file(self.out_file, use_arrow=True)
 
+    def dump(self):
         diff = {}
 
+        # on s3, store a hash of the data as object metadata so that unchanged data can be
+        # identified with a HEAD request rather than downloading and diffing the existing file
+        metadata = {CONTENT_HASH_KEY: gdf_hash(self.gdf, self.load_id)} if self.s3 else None
+
         # if output file *does not* exist, write it without running change detection
         if not self.out_file_exists:
             LOG.info("No existing file found, writing to file")
             if self.s3:
                 LOG.info(f"{self.s3_key} - writing to object storage")
-                self.s3.upload_file(
-                    os.path.join(self.tempdir, self.out_layer + ".gdb.zip"),
-                    os.environ.get("BUCKET"),
-                    self.s3_key,
-                )
+            if self.out_format == "parquet":
+                self._write_parquet(metadata=metadata)
             else:
-                shutil.copyfile(
-                    os.path.join(self.tempdir, self.out_layer + ".gdb.zip"), self.out_file
+                # write uncompressed .gdb in /tmp
+                self.gdf.to_file(
+                    os.path.join(self.tempdir, self.out_layer + ".gdb"),
+                    driver="OpenFileGDB",
+                    layer=self.out_layer,
                 )
+                self._write_gdb_zip(
+                    os.path.join(self.tempdir, self.out_layer + ".gdb"),
+                    self.out_file,
+                    s3_key=self.s3_key if self.s3 else None,
+                    metadata=metadata,
+                )
+            self._out_file_exists = True
+
+        # skip change detection if existing file was written from identical data
+        elif (
+            metadata and self._out_file_metadata.get(CONTENT_HASH_KEY) == metadata[CONTENT_HASH_KEY]
+        ):
+            LOG.info("Data unchanged (content hash matches existing file)")
 
         # run change detection if output file already exists
         else:
             LOG.info("Running change detection")
-            gdf_previous = geopandas.read_file(self.out_file)
+            gdf_previous = self._read_previous()
             diff = fcd.gdf_diff(
                 gdf_previous,
                 self.gdf,
@@ -386,56 +550,55 @@ class Layer:
 
                 # write changes gdb
                 changes_gdb = self.out_layer + "_changes.gdb"
-                # ensure tempfile does not already exist
-                mode = "w"
-                for key in [
-                    "NEW",
-                    "DELETED",
-                    "MODIFIED_BOTH",
-                    "MODIFIED_ATTR",
-                    "MODIFIED_GEOM",
-                ]:
-                    if len(diff[key]) > 0:
-                        # create empty geodataframe if geometry is not present
-                        if "geometry" not in diff[key].columns:
-                            diff[key] = geopandas.GeoDataFrame(
-                                diff[key], geometry=geopandas.GeoSeries([None] * len(diff[key]))
-                            )
-                        diff[key].to_file(
-                            os.path.join(self.tempdir, changes_gdb),
-                            driver="OpenFileGDB",
-                            layer=key,
-                            mode=mode,
+                # only write layers that have rows - the first creates the gdb
+                # (overwriting any existing tempfile), subsequent layers are appended
+                keys = [
+                    key
+                    for key in [
+                        "NEW",
+                        "DELETED",
+                        "MODIFIED_BOTH",
+                        "MODIFIED_ATTR",
+                        "MODIFIED_GEOM",
+                    ]
+                    if len(diff[key]) > 0
+                ]
+                for i, key in enumerate(keys):
+                    # create empty geodataframe if geometry is not present
+                    # (an object array of None avoids building a python list per row)
+                    if "geometry" not in diff[key].columns:
+                        diff[key] = geopandas.GeoDataFrame(
+                            diff[key], geometry=np.empty(len(diff[key]), dtype=object)
                         )
-                        mode = "a"
-                mode = "w"
-                zip_gdb(
-                    os.path.join(self.tempdir, changes_gdb),
-                    os.path.join(self.tempdir, changes_gdb + ".zip"),
-                )
+                    diff[key].to_file(
+                        os.path.join(self.tempdir, changes_gdb),
+                        driver="OpenFileGDB",
+                        layer=key,
+                        mode="w" if i == 0 else "a",
+                    )
                 if self.s3:
                     LOG.info(f"{self.s3_changes_key}: writing to object storage")
-                    self.s3.upload_file(
-                        os.path.join(self.tempdir, changes_gdb + ".zip"),
-                        os.environ.get("BUCKET"),
-                        self.s3_changes_key,
-                    )
-                else:
-                    shutil.copyfile(
-                        os.path.join(self.tempdir, changes_gdb + ".zip"),
-                        self.out_file.replace(self.out_layer + ".gdb.zip", changes_gdb + ".zip"),
-                    )
+                self._write_gdb_zip(
+                    os.path.join(self.tempdir, changes_gdb),
+                    self.changes_file,
+                    s3_key=self.s3_changes_key if self.s3 else None,
+                )
 
 
-def parse_config(config, out_path=".", load_id="fdl_load_id"):
-    """Parse and validate layer configuration json, adding out_file and load_id to layer definition"""
+def parse_config(config, out_path=".", load_id="fdl_load_id", validate=True):
+    """
+    Parse and validate layer configuration json, adding out_file and load_id to layer definition.
+    Schema validation can be skipped (validate=False) for configs already known to be valid.
+    """
     # validate sources against schema doc
-    with open("source_schema.json", "r") as f:
-        schema = json.load(f)
-    jsonschema.validate(instance=config, schema=schema)
+    if validate:
+        # raise the most relevant error, as jsonschema.validate() does
+        error = jsonschema.exceptions.best_match(schema_validator().iter_errors(config))
+        if error is not None:
+            raise error
 
-    # if no errors are raised by jsonschema, config is valid
-    LOG.info("Config json is valid")
+        # if no errors are raised by jsonschema, config is valid
+        LOG.info("Config json is valid")
 
     # turn each source from config into a "Layer"
     # a Layer has methods download/clean/dump and properites load_id/out_path plus config keys
@@ -452,6 +615,60 @@ def parse_config(config, out_path=".", load_id="fdl_load_id"):
     return layers
 
 
+def process_config(
+    config_file, admin_prefix, load_id="fdl_load_id", layer=None, schedule=None, dry_run=False
+):
+    """
+    Download data defined in config, write to s3 bucket if changed.
+    With dry_run=True, data is downloaded and cleaned (validating the sources) but not written.
+    Return a list of issues (title/body dicts) reporting changes to existing data.
+    """
+    # define output prefix
+    s3_prefix = "Change_Detection/" + admin_prefix
+
+    with open(config_file, "r") as f:
+        config = json.load(f)
+    issues = []
+    layers = parse_config(
+        config, load_id=load_id, out_path=os.path.join("s3://", os.environ.get("BUCKET"), s3_prefix)
+    )
+
+    # if specified, process only specified layer
+    if layer:
+        layers = [s for s in layers if s.out_layer == layer]
+        if len(layers) == 0:
+            LOG.warning(f"No layer named {layer} found in {config_file}")
+
+    # if specified, use only layers with given schedule tag
+    if schedule:
+        layers = [s for s in layers if s.schedule == schedule]
+        # alert if no layers in config match this schedule
+        if len(layers) == 0:
+            LOG.warning(f"No source with schedule={schedule} found in {config_file}")
+
+    for layer in layers:
+        report = {}
+        layer.download()
+        # data is not written on a dry run, skip the type consistency round trip
+        layer.clean(drop_geom_duplicates=True, strict_types=not dry_run)
+        if not dry_run:
+            layer.dump()
+            report.update(layer.duplicate_report)
+            report.update(layer.change_report)
+
+            # dump duplicates/changes report as text for creating a gh issue
+            # note that issues are only created if changes are present, not for fresh uploads
+            if layer.change_report:
+                issues.append(
+                    {
+                        "title": "Data changes: " + os.path.join(admin_prefix, layer.out_layer),
+                        "body": "<br />".join([k + ": " + str(report[k]) for k in report]),
+                    }
+                )
+
+    return issues
+
+
 @click.group()
 def cli():
     pass
@@ -471,14 +688,13 @@ def list_configs(path, schedule, verbose, quiet):
     """List all configs available in specified folder as RD/MUNI"""
     configure_logging((verbose - quiet))
     # note that folders prefixed with _ are ignored
-    files = glob.glob(os.path.join(path, "[!_]**/*.json"), recursive=True)
+    files = glob.iglob(os.path.join(path, "[!_]**/*.json"), recursive=True)
     for config_file in files:
-        # parse schedule if specified
+        # parse schedule if specified, stopping at the first matching source
         if schedule:
             with open(config_file, "r") as f:
                 config = json.load(f)
-            sources = [s for s in config if s["schedule"] == schedule]
-            if len(sources) > 0:
+            if any(s["schedule"] == schedule for s in config):
                 click.echo(os.path.splitext(Path(config_file).relative_to("sources"))[0])
         # otherwise just dump all file names
         else:
@@ -520,49 +736,15 @@ def process(
 ):
     """Download data defined in config, write to file if changed"""
     configure_logging((verbose - quiet))
-
-    # define output prefix
-    s3_prefix = "Change_Detection/" + admin_prefix
-
-    with open(config_file, "r") as f:
-        config = json.load(f)
-    issues = []
-    layers = parse_config(
-        config, load_id=load_id, out_path=os.path.join("s3://", os.environ.get("BUCKET"), s3_prefix)
+    issues = process_config(
+        config_file,
+        admin_prefix,
+        load_id=load_id,
+        layer=layer,
+        schedule=schedule,
+        dry_run=validate,
     )
 
-    # if specified, process only specified layer
-    if layer:
-        layers = [s for s in layers if s.out_layer == layer]
-        if len(layers) == 0:
-            LOG.warning(f"No layer named {layer} found in {config_file}")
-
-    # if specified, use only layers with given schedule tag
-    if schedule:
-        layers = [s for s in layers if s.schedule == schedule]
-        # alert if no layers in config match this schedule
-        if len(layers) == 0:
-            LOG.warning(f"No source with schedule={schedule} found in {config_file}")
-
-    for layer in layers:
-        report = {}
-        layer.download()
-        layer.clean(drop_geom_duplicates=True)
-        if not validate:
-            layer.dump()
-            report.update(layer.duplicate_report)
-            report.update(layer.change_report)
-
-            # dump duplicates/changes report as text for creating a gh issue
-            # note that issues are only created if changes are present, not for fresh uploads
-            if layer.change_report:
-                issues.append(
-                    {
-                        "title": "Data changes: " + os.path.join(admin_prefix, layer.out_layer),
-                        "body": "<br />".join([k + ": " + str(report[k]) for k in report]),
-                    }
-                )
-
     with open("issues.json", "w") as f:
         json.dump(issues, f, indent=2)
 
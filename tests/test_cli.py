@@ -1,69 +1,75 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 
-import boto3
 import geopandas
 import pytest
 from click.testing import CliRunner
 
-from fit_opendatadownloader.fit_downloader import cli
+from fit_opendatadownloader.fit_downloader import cli, process_config, s3_client
 
+# use the package's shared client (thread safe, with a connection pool sized for
+# concurrent requests)
+_s3 = s3_client()
 
-@pytest.fixture(autouse=True)
+# all tests in this module download live sources and write to the s3 bucket,
+# keep them on one xdist worker so the module's baseline download runs once
+pytestmark = [pytest.mark.integration, pytest.mark.xdist_group("cli")]
+
+# when running in parallel with pytest-xdist, give each worker its own prefix in the bucket
+_worker = os.environ.get("PYTEST_XDIST_WORKER")
+ADMIN_PREFIX = "_TESTING/test-" + _worker if _worker else "_TESTING/test"
+S3_PREFIX = "Change_Detection/" + ADMIN_PREFIX + "/"
+
+
+@pytest.fixture(scope="module", autouse=True)
 def cleanup():
-    s3_client = boto3.client("s3")
     yield
-    # after every test, delete everything in bucket with prefix /Change_Detection/_TESTING/test/
-    response = s3_client.list_objects_v2(
-        Bucket=os.environ.get("BUCKET"), Prefix="Change_Detection/_TESTING/test/"
-    )
-    if "Contents" in response:
-        objects_to_delete = [{"Key": obj["Key"]} for obj in response["Contents"]]
-        s3_client.delete_objects(
-            Bucket=os.environ.get("BUCKET"), Delete={"Objects": objects_to_delete}
+    # after all tests, delete everything in bucket with the test prefix
+    # (list pages hold up to 1000 keys, the most delete_objects accepts per request)
+    paginator = _s3.get_paginator("list_objects_v2")
+    batches = [
+        [{"Key": obj["Key"]} for obj in page["Contents"]]
+        for page in paginator.paginate(Bucket=os.environ.get("BUCKET"), Prefix=S3_PREFIX)
+        if "Contents" in page
+    ]
+    # send delete requests concurrently
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(
+            executor.map(
+                lambda batch: _s3.delete_objects(
+                    Bucket=os.environ.get("BUCKET"), Delete={"Objects": batch}
+                ),
+                batches,
+            )
         )
 
 
-def test_fresh_download():
-    runner = CliRunner()
-    result = runner.invoke(
-        cli,
-        [
-            "process",
-            "tests/test_config_a.json",
-            "_TESTING/test",
-            "--layer",
-            "parks",
-            "-v",
-        ],
-    )
-    assert result.exit_code == 0
+@pytest.fixture(scope="module")
+def fresh_download(cleanup):
+    """Process config a once, as the baseline shared by all tests in the module"""
+    # call the processing function directly, test_download_changed covers the cli wrapper
+    return process_config("tests/test_config_a.json", ADMIN_PREFIX, layer="parks")
+
+
+def test_fresh_download(fresh_download):
+    # issues are only reported for changes to existing data
+    assert fresh_download == []
     df = geopandas.read_file(
-        os.path.join(
-            "s3://", os.environ.get("BUCKET"), "Change_Detection/_TESTING/test/parks.gdb.zip"
-        )
+        os.path.join("s3://", os.environ.get("BUCKET"), S3_PREFIX, "parks.gdb.zip"),
+        use_arrow=True,
     )
     assert len(df) == 8
 
 
-def test_download_changed():
+def test_download_changed(fresh_download):
     runner = CliRunner()
-    result = runner.invoke(
-        cli,
-        [
-            "process",
-            "tests/test_config_a.json",
-            "_TESTING/test",
-            "--layer",
-            "parks",
-            "-v",
-        ],
-    )
     result = runner.invoke(
         cli,
         [
             "process",
             "tests/test_config_b.json",
-            "_TESTING/test",
+            ADMIN_PREFIX,
             "--layer",
             "parks",
             "-v",
@@ -71,26 +77,16 @@ def test_download_changed():
     )
     assert result.exit_code == 0
     df = geopandas.read_file(
-        os.path.join(
-            "s3://", os.environ.get("BUCKET"), "Change_Detection/_TESTING/test/parks.gdb.zip"
-        )
+        os.path.join("s3://", os.environ.get("BUCKET"), S3_PREFIX, "parks.gdb.zip"),
+        use_arrow=True,
     )
     assert len(df) == 8
-    df = geopandas.read_file(
-        os.path.join(
-            "s3://",
-            os.environ.get("BUCKET"),
-            "Change_Detection/_TESTING/test/parks_changes.gdb.zip",
-        ),
-        layer="NEW",
-    )
+    # fetch the changes gdb once, reading each layer from memory
+    changes = _s3.get_object(
+        Bucket=os.environ.get("BUCKET"),
+        Key=S3_PREFIX + "parks_changes.gdb.zip",
+    )["Body"].read()
+    df = geopandas.read_file(BytesIO(changes), layer="NEW", use_arrow=True)
     assert len(df) == 1
-    df = geopandas.read_file(
-        os.path.join(
-            "s3://",
-            os.environ.get("BUCKET"),
-            "Change_Detection/_TESTING/test/parks_changes.gdb.zip",
-        ),
-        layer="DELETED",
-    )
+    df = geopandas.read_file(BytesIO(changes), layer="DELETED", use_arrow=True)
     assert len(df) == 1
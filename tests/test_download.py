@@ -1,33 +1,48 @@
 import json
+import sys
+import types
+from unittest import mock
 
+import geopandas
 import pytest
 from jsonschema.exceptions import ValidationError
 
-from fit_opendatadownloader import Layer, parse_config
+from fit_opendatadownloader import Layer, fit_downloader, parse_config
+from fit_opendatadownloader.fit_downloader import CONTENT_HASH_KEY, gdf_hash
+
+# config shared by tests, tests get a copy via the test_config_file fixture (some modify it)
+CONFIG_FILE = [
+    {
+        "out_layer": "parks",
+        "metadata_url": None,
+        "source": "https://coquitlam-spatial.s3.us-west-2.amazonaws.com/PRC/GDB/Coquitlam_Parks_GDB.zip",
+        "source_layer": "parks",
+        "protocol": "http",
+        "query": None,
+        "fields": [
+            "PARKNAME",
+            "ADDRESS",
+            "PARKTYPE",
+            "OWNERSHIP",
+            "AREA_ACRES",
+            "PARK_LEVEL",
+        ],
+        "primary_key": ["PARKNAME", "AREA_ACRES"],
+        "schedule": "M",
+    }
+]
+
+
+@pytest.fixture(scope="session")
+def schema():
+    with open("source_schema.json", "r") as f:
+        return json.load(f)
 
 
 @pytest.fixture
 def test_config_file():
-    return [
-        {
-            "out_layer": "parks",
-            "metadata_url": None,
-            "source": "https://coquitlam-spatial.s3.us-west-2.amazonaws.com/PRC/GDB/Coquitlam_Parks_GDB.zip",
-            "source_layer": "parks",
-            "protocol": "http",
-            "query": None,
-            "fields": [
-                "PARKNAME",
-                "ADDRESS",
-                "PARKTYPE",
-                "OWNERSHIP",
-                "AREA_ACRES",
-                "PARK_LEVEL",
-            ],
-            "primary_key": ["PARKNAME", "AREA_ACRES"],
-            "schedule": "M",
-        }
-    ]
+    # the config is plain json, a json round trip copies it faster than deepcopy
+    return json.loads(json.dumps(CONFIG_FILE))
 
 
 @pytest.fixture
@@ -63,16 +78,40 @@ def test_config_esri():
     ]
 
 
+@pytest.fixture(scope="module")
+def fieldnames_gdf():
+    """Download tests/data/fieldnames.geojson once, tests clean a copy"""
+    sources = [
+        {
+            "out_layer": "parks",
+            "source": "tests/data/fieldnames.geojson",
+            "protocol": "http",
+            "fields": [
+                "SOURCE_DATA_ID",
+                "SUPPLIED_SOURCE_ID_IND",
+                "AIRPO#RT NAME $",
+                "DESCRIPTION",
+                "PHYSICAL_ADDRESS",
+                "ALIAS_ADDRESS",
+                "STREET_ADDRESS",
+                "POSTAL_CODE",
+                "LOCALITY",
+            ],
+            "schedule": "Q",
+        }
+    ]
+    layer = parse_config(sources, validate=False)[0]
+    layer.download()
+    return layer.gdf
+
+
 # parsing does not fail so config is valid
 def test_parse_config(test_config_file):
     layer = parse_config(test_config_file)[0]
     assert layer.out_layer == "parks"
 
 
-def test_all_keys_present():
-    # read schema document
-    with open("source_schema.json", "r") as f:
-        schema = json.load(f)
+def test_all_keys_present(schema):
     # create source layer from required keys
     source_dict = {k: "foo" for k in schema["items"]["required"]}
     layer = Layer(source_dict)
@@ -81,13 +120,17 @@ def test_all_keys_present():
         assert hasattr(layer, k)
 
 
-def test_download_file(test_config_file, tmpdir):
-    layer = parse_config(test_config_file)[0]
+@pytest.mark.integration
+@pytest.mark.xdist_group("coquitlam")
+def test_download_file(test_config_file):
+    layer = parse_config(test_config_file, validate=False)[0]
     layer.download()
     assert len(layer.gdf) > 0
 
 
-def test_download_bcgw(tmpdir):
+@pytest.mark.integration
+@pytest.mark.xdist_group("bcgw")
+def test_download_bcgw():
     sources = [
         {
             "out_layer": "parks",
@@ -104,33 +147,98 @@ def test_download_bcgw(tmpdir):
             "schedule": "Q",
         }
     ]
-    layer = parse_config(sources)[0]
+    layer = parse_config(sources, validate=False)[0]
     layer.download()
     assert len(layer.gdf) == 3
 
 
-def test_invalid_file(test_config_file):
-    layer = parse_config(test_config_file)[0]
-    layer.fields = ["INVALID_COLUMN"]
+def test_download_bcgw_mocked(monkeypatch):
+    # stand in for bcdata with a saved WFS response from the airports layer
+    def get_data(dataset, query=None, as_gdf=False):
+        assert dataset == "WHSE_IMAGERY_AND_BASE_MAPS.GSR_AIRPORTS_SVW"
+        assert query == "SOURCE_DATA_ID in (456, 457)"
+        return geopandas.read_file("tests/data/fieldnames.geojson")
+
+    monkeypatch.setitem(sys.modules, "bcdata", types.SimpleNamespace(get_data=get_data))
+    sources = [
+        {
+            "out_layer": "parks",
+            "source": "WHSE_IMAGERY_AND_BASE_MAPS.GSR_AIRPORTS_SVW",
+            "protocol": "bcgw",
+            "fields": [
+                "SOURCE_DATA_ID",
+                "DESCRIPTION",
+                "LOCALITY",
+            ],
+            "query": "SOURCE_DATA_ID in (456, 457)",
+            "primary_key": ["SOURCE_DATA_ID"],
+            "schedule": "Q",
+        }
+    ]
+    layer = parse_config(sources, validate=False)[0]
+    layer.download()
+    assert len(layer.gdf) == 2
+
+
+def test_invalid_file():
+    sources = [
+        {
+            "out_layer": "parks",
+            "source": "tests/data/fieldnames.geojson",
+            "protocol": "http",
+            "fields": ["INVALID_COLUMN"],
+            "schedule": "Q",
+        }
+    ]
+    layer = parse_config(sources, validate=False)[0]
     with pytest.raises(ValueError):
         layer.download()
 
 
-def test_invalid_pk(test_config_file):
-    config = test_config_file
-    config[0]["primary_key"] = ["PARK_NAME_INVALID"]
-    with pytest.raises(ValueError):
-        parse_config(config)
+def test_download_field_case():
+    sources = [
+        {
+            "out_layer": "parks",
+            "source": "tests/data/fieldnames.geojson",
+            "protocol": "http",
+            "fields": ["source_data_id", "Description"],
+            "schedule": "Q",
+        }
+    ]
+    layer = parse_config(sources, validate=False)[0]
+    layer.download()
+    assert {"SOURCE_DATA_ID", "DESCRIPTION"}.issubset(layer.gdf.columns)
+
+
+def test_download_missing_field():
+    sources = [
+        {
+            "out_layer": "parks",
+            "source": "tests/data/fieldnames.geojson",
+            "protocol": "http",
+            "fields": ["SOURCE_DATA_ID", "INVALID_COLUMN"],
+            "schedule": "Q",
+        }
+    ]
+    layer = parse_config(sources, validate=False)[0]
+    with pytest.raises(ValueError, match="INVALID_COLUMN"):
+        layer.download()
 
 
-def test_invalid_schedule(test_config_file):
-    sources = test_config_file
-    sources[0]["schedule"] = "MONTH"
-    with pytest.raises(ValidationError):
-        parse_config(sources)
+@pytest.mark.parametrize(
+    "key,value,exception",
+    [
+        ("primary_key", ["PARK_NAME_INVALID"], ValueError),
+        ("schedule", "MONTH", ValidationError),
+    ],
+)
+def test_invalid_config(test_config_file, key, value, exception):
+    test_config_file[0][key] = value
+    with pytest.raises(exception):
+        parse_config(test_config_file)
 
 
-def test_clean_columns():
+def test_clean_columns(fieldnames_gdf):
     sources = [
         {
             "out_layer": "parks",
@@ -151,13 +259,13 @@ def test_clean_columns():
             "schedule": "Q",
         }
     ]
-    layer = parse_config(sources)[0]
-    layer.download()
+    layer = parse_config(sources, validate=False)[0]
+    layer.gdf = fieldnames_gdf.copy()
     layer.clean()
     assert "airport_name_" in layer.gdf.columns
 
 
-def test_hash_pk():
+def test_hash_pk(fieldnames_gdf):
     sources = [
         {
             "out_layer": "parks",
@@ -177,8 +285,8 @@ def test_hash_pk():
             "schedule": "Q",
         }
     ]
-    layer = parse_config(sources)[0]
-    layer.download()
+    layer = parse_config(sources, validate=False)[0]
+    layer.gdf = fieldnames_gdf.copy()
     layer.clean(precision=0.1)
     assert layer.gdf["fdl_load_id"].iloc[0] == "597b8d8bef757cb12fec15ce027fb2c6f84775d7"
 
@@ -195,7 +303,7 @@ def test_mixed_types():
             "schedule": "Q",
         }
     ]
-    layer = parse_config(sources)[0]
+    layer = parse_config(sources, validate=False)[0]
     layer.download()
     layer.clean()
     assert [t.upper() for t in layer.gdf.geometry.geom_type.unique()] == ["MULTIPOINT"]
@@ -216,7 +324,7 @@ def test_duplicate_pk():
             "schedule": "Q",
         }
     ]
-    layer = parse_config(sources)[0]
+    layer = parse_config(sources, validate=False)[0]
     layer.download()
     with pytest.raises(ValueError):
         layer.clean()
@@ -234,7 +342,7 @@ def test_duplicate_geom():
             "schedule": "Q",
         }
     ]
-    layer = parse_config(sources)[0]
+    layer = parse_config(sources, validate=False)[0]
     layer.download()
     layer.clean(precision=0.1, drop_geom_duplicates=True)
     assert len(layer.duplicates) == 2
@@ -252,8 +360,108 @@ def test_hash_fields():
             "schedule": "Q",
         }
     ]
-    layer = parse_config(sources)[0]
+    layer = parse_config(sources, validate=False)[0]
     layer.download()
     layer.gdf.at[1, "geometry"] = layer.gdf.at[0, "geometry"]
     layer.clean()
     assert len(layer.gdf) == 2
+
+
+def test_dump_parquet(tmp_path):
+    sources = [
+        {
+            "out_layer": "parks",
+            "source": "tests/data/fieldnames.geojson",
+            "protocol": "http",
+            "fields": ["SOURCE_DATA_ID", "DESCRIPTION"],
+            "primary_key": ["SOURCE_DATA_ID"],
+            "schedule": "Q",
+            "out_format": "parquet",
+        }
+    ]
+    layer = parse_config(sources, out_path=str(tmp_path), validate=False)[0]
+    layer.download()
+    layer.clean()
+    layer.dump()
+    df = geopandas.read_parquet(tmp_path / "parks.parquet")
+    assert len(df) == len(layer.gdf)
+
+    # remove a record, change detection runs against the existing parquet file
+    layer = parse_config(sources, out_path=str(tmp_path), validate=False)[0]
+    layer.download()
+    layer.gdf = layer.gdf.iloc[:1]
+    layer.clean()
+    layer.dump()
+    assert layer.change_report["n_deletions"] == 1
+    df = geopandas.read_file(tmp_path / "parks_changes.gdb.zip", layer="DELETED")
+    assert len(df) == 1
+
+    # identical data, nothing is reported
+    (tmp_path / "parks_changes.gdb.zip").unlink()
+    layer = parse_config(sources, out_path=str(tmp_path), validate=False)[0]
+    layer.download()
+    layer.clean()
+    layer.dump()
+    assert layer.change_report == {}
+    assert not (tmp_path / "parks_changes.gdb.zip").exists()
+
+
+def test_gdf_hash():
+    df = geopandas.GeoDataFrame(
+        {"id": [1, 2, 3], "name": ["a", "b", "c"]},
+        geometry=geopandas.points_from_xy([0, 1, 2], [0, 1, 2]),
+        crs=3005,
+    )
+    digest = gdf_hash(df, "id")
+    # row order does not matter
+    assert gdf_hash(df.iloc[::-1], "id") == digest
+    # an attribute edit changes the digest
+    edited = df.copy()
+    edited.loc[1, "name"] = "x"
+    assert gdf_hash(edited, "id") != digest
+    # a geometry edit changes the digest
+    edited = df.copy()
+    edited.loc[1, "geometry"] = geopandas.points_from_xy([1], [1.5])[0]
+    assert gdf_hash(edited, "id") != digest
+
+
+@pytest.mark.parametrize("hash_matches", [True, False])
+def test_dump_content_hash(tmp_path, monkeypatch, hash_matches):
+    sources = [
+        {
+            "out_layer": "parks",
+            "source": "tests/data/fieldnames.geojson",
+            "protocol": "http",
+            "fields": ["SOURCE_DATA_ID", "DESCRIPTION"],
+            "primary_key": ["SOURCE_DATA_ID"],
+            "schedule": "Q",
+        }
+    ]
+    layer = parse_config(sources, out_path=str(tmp_path), validate=False)[0]
+    layer.download()
+    layer.clean()
+    # stand in for an existing s3 object, with the hash of the data it was written from
+    layer.s3 = mock.Mock()
+    layer._out_file_exists = True
+    layer._out_file_metadata = {
+        CONTENT_HASH_KEY: gdf_hash(layer.gdf, layer.load_id) if hash_matches else "outdated"
+    }
+    read_previous = mock.Mock(return_value=layer.gdf)
+    monkeypatch.setattr(layer, "_read_previous", read_previous)
+    gdf_diff = mock.Mock(
+        return_value={
+            "NEW": layer.gdf.iloc[0:0],
+            "DELETED": layer.gdf.iloc[0:0],
+            "UNCHANGED": layer.gdf,
+            "MODIFIED_BOTH": layer.gdf.iloc[0:0],
+            "MODIFIED_ATTR": layer.gdf.iloc[0:0],
+            "MODIFIED_GEOM": layer.gdf.iloc[0:0],
+        }
+    )
+    monkeypatch.setattr(fit_downloader.fcd, "gdf_diff", gdf_diff)
+    layer.dump()
+    # change detection only runs when the stored hash does not match
+    assert read_previous.called is not hash_matches
+    assert gdf_diff.called is not hash_matches
+    assert layer.change_report == {}
+    layer.s3.upload_fileobj.assert_not_called()